@@ -7,14 +7,46 @@ The drug labels are downloaded from https://open.fda.gov/apis/drug/label/downloa
 
 import bs4
 import json
+import ijson
+import orjson
 import re
-from openai import OpenAI
+import time
+import asyncio
+import os
+import hashlib
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from openai import (
+    OpenAI, AsyncOpenAI, APIConnectionError, APITimeoutError, BadRequestError, InternalServerError, RateLimitError
+)
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 import pandas as pd
 import numpy as np
 
 client = OpenAI()
-
-instructions = """
+# retries are handled by tenacity in _create_chat_completion, so the SDK's own retries are disabled
+async_client = AsyncOpenAI(max_retries=0)
+
+MODEL = "gpt-4o-mini"
+# responses are only cached when sampling is deterministic
+TEMPERATURE = 0
+# output token budget per drug label, and the model's maximum output tokens per request
+MAX_TOKENS = 2048
+MAX_OUTPUT_TOKENS = 16384
+
+# percentages like '29 %' or '<1 %', and numbers without %
+_NUMERIC_RE = re.compile(r'^<?(\d+(?:\.\d+)?)\s*%?$')
+
+# persistent cache of model responses, keyed on the SHA256 of the model, instructions and label;
+# opened lazily by _get_cache so that process_shard workers never hold the connection
+CACHE_PATH = 'data/.llm_cache.sqlite'
+_cache = None
+
+# static instruction block, sent first as the system message so that every request shares a
+# byte-identical prefix. At roughly 500 tokens it is below the 1024-token minimum of OpenAI's
+# automatic prompt caching, so it is only cached if it grows past that threshold.
+INSTRUCTIONS = """
 You are a bioinformatician that extracts the adverse effects from drug labels of FDA-approved drugs.
 
 Your task is to extract the adverse effects from given text and HTML tables from **Section 6 (Adverse Reactions)** of a drug product label and return them in a structured format.
@@ -68,7 +100,44 @@ The structured output should be in **JSON format** with the following schema:
 Return **only** the structured JSON. Do not include any commentary or explanatory text.
 """
 
-def parse_adverse_reactions_table_llm(html_string: str) -> dict:
+# appended to the system message when several drug labels are sent in a single request
+BATCHED_INSTRUCTIONS = """
+### Multiple Drug Labels:
+
+You may be given several drug labels in one message, each wrapped in a `<drug id="N">...</drug>` tag.
+Extract each drug label independently following the rules above, and return a JSON object whose `"drugs"` array has one object per drug label.
+Each object follows the schema above, plus an `"id"` field set to the integer id of its tag:
+
+```json
+{
+  "drugs": [
+    {"id": 0, "drug_name": "string", "drug_route": "string", "adverse_effects": [...]},
+    {"id": 1, "drug_name": "string", "drug_route": "string", "adverse_effects": [...]}
+  ]
+}
+```
+"""
+
+@retry(
+    wait=wait_random_exponential(min=1, max=60),
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type((RateLimitError, APIConnectionError, APITimeoutError, InternalServerError))
+)
+async def _create_chat_completion(messages: list, max_tokens: int = MAX_TOKENS):
+    """
+    Send a chat completion request in JSON mode, retrying rate limits, connection errors,
+    timeouts and server errors with exponential backoff. Other errors (e.g. a bad API key or
+    model name) are raised immediately.
+    """
+    return await async_client.chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        temperature=TEMPERATURE,
+        response_format={"type": "json_object"},
+        max_tokens=max_tokens
+    )
+
+async def parse_adverse_reactions_table_llm(html_string: str) -> dict:
     """
     Parse an HTML table of adverse reactions and return structured data using OpenAI API.
 
@@ -88,21 +157,318 @@ def parse_adverse_reactions_table_llm(html_string: str) -> dict:
             'spl-set-id': str
         }
     """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "user", "content": instructions},
-            {"role": "user", "content": html_string}
-        ],
-        # max_tokens=500
-    )
+    key = _cache_key(html_string)
+    cached = _cache_get(key)
+    if cached is not None:
+        return _parse_response(cached)
+    response = await _create_chat_completion(_build_messages(html_string))
+    if response.choices[0].finish_reason == 'length':
+        raise ValueError("Response was cut off by the output token limit")
     json_response = response.choices[0].message.content
-    # strip the ```json and ``` from the start and end of the response
-    json_response = json_response.strip().lstrip('```json').rstrip('```')
-    # print(f"json response: {json_response}")
-    dict_response = json.loads(json_response)
+    dict_response = _parse_response(json_response)
+    _cache_set(key, json_response)
     return dict_response
 
+async def parse_adverse_reactions_table_batch_llm(html_strings: list) -> list:
+    """
+    Extract the adverse effects of several drug labels in a single request.
+
+    If the request exceeds the model's context length, the response is cut off by the output
+    token limit, or the response is not a valid "drugs" payload, the drug labels are split in
+    half and each half is sent separately. A single drug label whose response cannot be parsed
+    is returned as None, so it does not take the rest of its group down with it.
+
+    Args:
+        html_strings (list): HTML content of each drug label.
+    Returns:
+        list: The parsed response of each drug label, in the same order, or None if the model
+        did not return it.
+    """
+    if len(html_strings) == 1:
+        try:
+            return [await parse_adverse_reactions_table_llm(html_strings[0])]
+        except ValueError as e:
+            # truncated or unparseable response (json.JSONDecodeError is a ValueError)
+            print(f"Could not parse response: {e}")
+            return [None]
+    try:
+        response = await _create_chat_completion(
+            _build_batched_messages(html_strings),
+            max_tokens=min(MAX_TOKENS * len(html_strings), MAX_OUTPUT_TOKENS)
+        )
+        truncated = response.choices[0].finish_reason == 'length'
+    except BadRequestError as e:
+        if e.code != 'context_length_exceeded':
+            raise
+        truncated = True
+    drugs = None
+    if not truncated:
+        try:
+            drugs = _parse_response(response.choices[0].message.content).get('drugs')
+        except (json.JSONDecodeError, AttributeError):
+            pass
+    if not isinstance(drugs, list):
+        half = len(html_strings) // 2
+        halves = [html_strings[:half], html_strings[half:]]
+        # a failure in one half must not discard the other half's results
+        results = await asyncio.gather(
+            *[parse_adverse_reactions_table_batch_llm(html_half) for html_half in halves],
+            return_exceptions=True
+        )
+        merged = []
+        for html_half, result in zip(halves, results):
+            if isinstance(result, BaseException):
+                print(f"Extraction failed for {len(html_half)} drug labels: {result}")
+                merged.extend([None] * len(html_half))
+            else:
+                merged.extend(result)
+        return merged
+    # scatter the results back by id
+    results = [None] * len(html_strings)
+    for dict_response in drugs:
+        if not isinstance(dict_response, dict):
+            continue
+        i = dict_response.pop('id', None)
+        if isinstance(i, int) and 0 <= i < len(html_strings):
+            results[i] = dict_response
+    for html_string, dict_response in zip(html_strings, results):
+        if dict_response is not None:
+            _cache_set(_cache_key(html_string, BATCHED_INSTRUCTIONS), json.dumps(dict_response))
+    return results
+
+async def parse_adverse_reactions_tables_llm(html_contents: dict, concurrency: int = 20, drugs_per_request: int = 10) -> dict:
+    """
+    Extract the adverse effects of many drug labels concurrently.
+
+    Args:
+        html_contents (dict): Mapping of drug SPL set id to the HTML content of its label.
+        concurrency (int): Maximum number of requests in flight at once.
+        drugs_per_request (int): Number of drug labels sent in each request.
+    Returns:
+        dict: Mapping of drug SPL set id to the parsed response.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {}
+
+    # only send the drug labels that are not already cached
+    uncached_spl_set_ids = []
+    for spl_set_id, html_content in html_contents.items():
+        cached = _cache_lookup(html_content)
+        if cached is not None:
+            results[spl_set_id] = _parse_response(cached)
+        else:
+            uncached_spl_set_ids.append(spl_set_id)
+
+    async def extract(spl_set_ids: list) -> None:
+        async with semaphore:
+            try:
+                ae_dicts = await parse_adverse_reactions_table_batch_llm([html_contents[spl_set_id] for spl_set_id in spl_set_ids])
+            except Exception as e:
+                print(f"Extraction failed for {', '.join(spl_set_ids)}: {e}")
+                return
+        for spl_set_id, ae_dict in zip(spl_set_ids, ae_dicts):
+            if ae_dict is None:
+                print(f"No response returned for {spl_set_id}")
+            else:
+                results[spl_set_id] = ae_dict
+
+    await asyncio.gather(*[
+        extract(uncached_spl_set_ids[i:i + drugs_per_request])
+        for i in range(0, len(uncached_spl_set_ids), drugs_per_request)
+    ])
+    return results
+
+def _cache_key(html_string: str, batched_instructions: str = "") -> str:
+    """
+    Compute the cache key of a request from the model, instructions and label content.
+
+    Responses from requests with several drug labels are keyed with BATCHED_INSTRUCTIONS folded
+    in, so they never pose as single-label responses. The other labels sent in the same request
+    are deliberately left out of the key, so a label's batched response can be reused whatever
+    it was grouped with.
+    """
+    return hashlib.sha256((MODEL + INSTRUCTIONS + batched_instructions + html_string).encode()).hexdigest()
+
+def _cache_lookup(html_string: str):
+    """
+    Return the cached response for a drug label from a single-label request, falling back to
+    one from a request with several drug labels, or None on a miss.
+    """
+    cached = _cache_get(_cache_key(html_string))
+    if cached is None:
+        cached = _cache_get(_cache_key(html_string, BATCHED_INSTRUCTIONS))
+    return cached
+
+def _get_cache() -> sqlite3.Connection:
+    """
+    Return the connection to the response cache, opening it on first use.
+    """
+    global _cache
+    if _cache is None:
+        _cache = sqlite3.connect(CACHE_PATH)
+        _cache.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT)")
+    return _cache
+
+def _cache_get(key: str):
+    """
+    Return the cached response for a key, or None on a miss.
+    """
+    if TEMPERATURE > 0:
+        return None
+    row = _get_cache().execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def _cache_set(key: str, response: str) -> None:
+    """
+    Store a response in the cache.
+    """
+    if TEMPERATURE > 0:
+        return
+    cache = _get_cache()
+    cache.execute("INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)", (key, response))
+    cache.commit()
+
+def _build_messages(html_string: str) -> list:
+    """
+    Build the chat messages sent to the model for a single drug label.
+    """
+    return [
+        {"role": "system", "content": INSTRUCTIONS},
+        {"role": "user", "content": html_string}
+    ]
+
+def _build_batched_messages(html_strings: list) -> list:
+    """
+    Build the chat messages sent to the model for several drug labels, each tagged with its index.
+    """
+    content = "\n\n".join(f'<drug id="{i}">{html_string}</drug>' for i, html_string in enumerate(html_strings))
+    return [
+        {"role": "system", "content": INSTRUCTIONS + BATCHED_INSTRUCTIONS},
+        {"role": "user", "content": content}
+    ]
+
+def _parse_response(content: str) -> dict:
+    """
+    Parse the content of a chat completion into a dictionary.
+
+    Requests use JSON mode, but responses cached before it was enabled may still be wrapped in
+    a ```json code fence. Shared by the online path and the Batch API path.
+    """
+    # strip the literal ```json / ``` prefix and ``` suffix (lstrip/rstrip would strip characters)
+    json_response = content.strip()
+    if json_response.startswith("```json"):
+        json_response = json_response[len("```json"):]
+    elif json_response.startswith("```"):
+        json_response = json_response[len("```"):]
+    if json_response.endswith("```"):
+        json_response = json_response[:-len("```")]
+    # print(f"json response: {json_response}")
+    return json.loads(json_response.strip())
+
+def write_batch_requests(html_contents: dict, path: str) -> None:
+    """
+    Write one Batch API request per drug label to a JSONL file.
+
+    Args:
+        html_contents (dict): Mapping of drug SPL set id to the HTML content of its label.
+        path (str): Path of the JSONL file to write.
+    """
+    with open(path, 'w') as f:
+        for spl_set_id, html_content in html_contents.items():
+            request = {
+                "custom_id": spl_set_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": MODEL,
+                    "messages": _build_messages(html_content),
+                    "temperature": TEMPERATURE,
+                    "response_format": {"type": "json_object"},
+                    "max_tokens": MAX_TOKENS
+                }
+            }
+            f.write(json.dumps(request) + '\n')
+
+def submit_batch(path: str) -> str:
+    """
+    Upload a JSONL request file and submit it as a batch job.
+
+    Args:
+        path (str): Path of the JSONL file written by write_batch_requests.
+    Returns:
+        str: The id of the submitted batch.
+    """
+    with open(path, 'rb') as f:
+        batch_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    return batch.id
+
+def wait_for_batch(batch_id: str, poll_interval: int = 60):
+    """
+    Poll a batch job until it reaches a terminal status.
+
+    An expired or cancelled batch is still returned, since it can hold a partial output file.
+
+    Args:
+        batch_id (str): The id of the batch.
+        poll_interval (int): Seconds to wait between status checks.
+    Returns:
+        The batch object in its terminal status.
+    """
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        print(f"Batch {batch_id} status: {batch.status}")
+        if batch.status in ("completed", "expired", "cancelled"):
+            return batch
+        if batch.status == "failed":
+            raise RuntimeError(f"Batch {batch_id} ended with status {batch.status}")
+        time.sleep(poll_interval)
+
+def read_batch_results(batch, html_contents: dict) -> dict:
+    """
+    Stream the output file of a finished batch, parse each response and cache it, and report
+    the requests in its error file.
+
+    Args:
+        batch: The batch object returned by wait_for_batch.
+        html_contents (dict): Mapping of drug SPL set id to the HTML content submitted in the batch.
+    Returns:
+        dict: Mapping of drug SPL set id to the parsed response.
+    """
+    results = {}
+    if batch.error_file_id is not None:
+        errors = client.files.content(batch.error_file_id)
+        for line in errors.iter_lines():
+            if not line:
+                continue
+            result = json.loads(line)
+            print(f"Batch request failed for {result['custom_id']}: {result.get('error') or result.get('response')}")
+    if batch.output_file_id is None:
+        return results
+    output = client.files.content(batch.output_file_id)
+    for line in output.iter_lines():
+        if not line:
+            continue
+        result = json.loads(line)
+        spl_set_id = result['custom_id']
+        response = result.get('response')
+        if result.get('error') or response is None or response['status_code'] != 200:
+            print(f"Batch request failed for {spl_set_id}")
+            continue
+        json_response = response['body']['choices'][0]['message']['content']
+        try:
+            results[spl_set_id] = _parse_response(json_response)
+        except json.JSONDecodeError:
+            print(f"Could not parse response for {spl_set_id}")
+            continue
+        if spl_set_id in html_contents:
+            _cache_set(_cache_key(html_contents[spl_set_id]), json_response)
+    return results
+
 def parse_adverse_reactions_table(html_string: str) -> dict:
     """
     Parse an HTML table of adverse reactions and return structured data.
@@ -119,8 +485,8 @@ def parse_adverse_reactions_table(html_string: str) -> dict:
             ]
         }
     """
-    # Parse HTML
-    soup = bs4.BeautifulSoup(html_string, 'html.parser')
+    # Parse HTML, only building the tree for <table> elements
+    soup = bs4.BeautifulSoup(html_string, 'lxml', parse_only=bs4.SoupStrainer('table'))
     table = soup.find('table')
     if not table:
         raise ValueError("No <table> found in provided HTML.")
@@ -144,17 +510,12 @@ def parse_adverse_reactions_table(html_string: str) -> dict:
         row_dict = {}
         for header, cell in zip(headers, cells):
             text = cell.get_text(strip=True)
-            # try to parse percentages like '29 %' or '<1 %'
-            pct_match = re.match(r'^<?(\d+(?:\.\d+)?)\s*%$', text)
-            if pct_match:
-                row_dict[header] = float(pct_match.group(1))
+            # try to parse percentages like '29 %' or '<1 %', or numeric without %
+            numeric_match = _NUMERIC_RE.match(text)
+            if numeric_match:
+                row_dict[header] = float(numeric_match.group(1))
             else:
-                # try numeric without %
-                num_match = re.match(r'^<?(\d+(?:\.\d+)?)$', text)
-                if num_match:
-                    row_dict[header] = float(num_match.group(1))
-                else:
-                    row_dict[header] = text
+                row_dict[header] = text
         data_rows.append(row_dict)
 
     return {
@@ -162,59 +523,183 @@ def parse_adverse_reactions_table(html_string: str) -> dict:
         'data': data_rows
     }
 
+def build_adverse_effects_table(drug_info: list) -> pd.DataFrame:
+    """
+    Build a wide table with one row per drug and one column per adverse effect.
+
+    Args:
+        drug_info (list): Parsed responses of the drug labels.
+    Returns:
+        pd.DataFrame: The 'drug_name' column followed by the percentage of each adverse effect,
+        NaN where a drug does not list the adverse effect or its percentage is not numeric.
+        Drugs and adverse effects with missing keys are left out.
+    """
+    # JSON mode does not enforce the schema, so drugs and adverse effects missing a key are skipped
+    drug_names = []
+    percentages = []
+    for drug in drug_info:
+        drug_name = drug.get('drug_name')
+        adverse_effects = drug.get('adverse_effects')
+        if not drug_name or not isinstance(adverse_effects, list):
+            print(f"Dropping malformed drug {drug.get('drug_spl_set_id')}: missing drug_name or adverse_effects")
+            continue
+        drug_percentages = {}
+        for ae in adverse_effects:
+            if not isinstance(ae, dict) or not isinstance(ae.get('adverse_effect'), str) or 'percentage' not in ae:
+                print(f"Dropping malformed adverse effect {ae!r} for {drug_name}")
+                continue
+            drug_percentages[ae['adverse_effect']] = ae['percentage']
+        drug_names.append(drug_name)
+        percentages.append(drug_percentages)
+    # union of the adverse effects in first-seen order, in a single pass over all records
+    columns = list(dict.fromkeys(ae for drug in percentages for ae in drug))
+    # building the frame from all records at once avoids reallocating it for every row
+    df = pd.DataFrame.from_records(percentages, columns=columns)
+    # the model can also return percentages as strings like '<1'
+    numeric = df.apply(pd.to_numeric, errors='coerce')
+    dropped = df.notna() & numeric.isna()
+    for row, column in zip(*np.nonzero(dropped.to_numpy())):
+        print(f"Dropping non-numeric percentage {df.iat[row, column]!r} of {columns[column]} for {drug_names[row]}")
+    numeric.insert(0, 'drug_name', drug_names)
+    return numeric
+
+
+def process_shard(path: str, limit: int) -> list:
+    """
+    Collect the drug labels with an adverse reactions table from a single shard.
+
+    Args:
+        path (str): Path of the drug label JSON file.
+        limit (int): Stop once more than this many drug labels have been collected.
+    Returns:
+        list of dictionaries: [
+            {
+                'drug_spl_set_id': str,
+                'drug_route': str,
+                'html_content': str,
+            }
+        ]
+    """
+    drug_labels_to_extract = []
+
+    # stream the drug labels one at a time instead of loading the whole file into memory
+    with open(path, 'rb') as f:
+        for drug_label in ijson.items(f, 'results.item'):
+            if (len(drug_labels_to_extract) > limit):
+                print(f"Reached {limit} drug labels in {path}, stopping.")
+                break
+            drug_name = None
+            if 'openfda' in drug_label and 'generic_name' in drug_label['openfda']:
+                drug_name = drug_label['openfda']['generic_name'][0]
+            else:
+                print(f"No generic name found for {drug_label['id']}")
+                continue
+            assert drug_name is not None, "Drug name should not be None"
+            if 'adverse_reactions_table' in drug_label and 'adverse_reactions' in drug_label and 'openfda' in drug_label and 'route' in drug_label['openfda']:
+                html_content = ''.join(drug_label['adverse_reactions'] + drug_label['adverse_reactions_table'])
+
+                drug_labels_to_extract.append({
+                    'drug_spl_set_id': drug_label['openfda']['spl_set_id'][0],
+                    'drug_route': drug_label['openfda']['route'][0],
+                    'html_content': html_content
+                })
+            else:
+                print(f"No adverse reactions table found for {drug_name}")
+                continue
+
+    return drug_labels_to_extract
+
 
 # data_files = [f"data/drug-label-00{i}-of-0013.json" for i in range(1, 14)]
 # data_files = ['data/drug-label-0013-of-0013.json', 'data/drug-label-0012-of-0013.json']
 data_files = ['data/drug-label-0013-of-0013.json']
 
-drug_info = []
-
-cnt = 0
 cnt_limit = 25
 
-for file in data_files:
-    with open(file, 'r') as f:
-        data = json.load(f)
-    
-    drug_labels = data['results']
-
+# submit all drug labels as a single asynchronous job through the OpenAI Batch API
+use_batch_api = True
+batch_requests_file = 'data/ae_requests.jsonl'
+# maximum number of concurrent requests when not using the Batch API
+concurrency = 20
+# number of drug labels sent in each request when not using the Batch API
+drugs_per_request = 10
+
+if __name__ == "__main__":
+    drug_info = []
+    # drug SPL set id -> route and HTML content of the labels to extract
+    drug_labels_to_extract = {}
+
+    # the shards are independent, so they are read in parallel across CPU cores
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        shards = list(executor.map(partial(process_shard, limit=cnt_limit), data_files))
+
+    cnt = 0
+    for shard in shards:
+        for label in shard:
+            if (cnt > cnt_limit):
+                break
+            drug_labels_to_extract[label['drug_spl_set_id']] = {
+                'drug_route': label['drug_route'],
+                'html_content': label['html_content']
+            }
+            cnt += 1
     if (cnt > cnt_limit):
         print(f"Reached {cnt_limit} drug labels, stopping.")
-        break
-
-    for drug_label in drug_labels:
-        if (cnt > cnt_limit):
-            print(f"Reached {cnt_limit} drug labels, stopping.")
-            break
-        drug_name = None
-        if 'openfda' in drug_label and 'generic_name' in drug_label['openfda']:
-            drug_name = drug_label['openfda']['generic_name'][0]
-        else:
-            print(f"No generic name found for {drug_label['id']}")
-            continue
-        assert drug_name is not None, "Drug name should not be None"
-        if 'adverse_reactions_table' in drug_label and 'adverse_reactions' in drug_label and 'openfda' in drug_label and 'route' in drug_label['openfda']:
-            html_content = drug_label['adverse_reactions'][0]
-            for i in range(1, len(drug_label['adverse_reactions'])):
-                html_content += drug_label['adverse_reactions'][i]
-            for i in range(0, len(drug_label['adverse_reactions_table'])):
-                html_content += drug_label['adverse_reactions_table'][i]
-
-            ae_dict = parse_adverse_reactions_table_llm(html_content)
-            ae_dict['drug_spl_set_id'] = drug_label['openfda']['spl_set_id'][0]
-            ae_dict['drug_route'] = drug_label['openfda']['route'][0]
-            # print(ae_dict)
-
-            # add this to all the information
-            print('added information')
-            cnt += 1
-            drug_info.append(ae_dict)
-        else:
-            print(f"No adverse reactions table found for {drug_name}")
-            continue
 
-# drump the drug_info into a JSON file
-print(f"Writing {len(drug_info)} drug labels to file.")
-with open('data/drug_info.json', 'w') as f:
-    f.write(json.dumps(drug_info, indent=4))
-print("Done.")
+    # drug labels with identical content (e.g. the same product under several NDCs) are only extracted once
+    html_contents = {}
+    # drug SPL set id -> SPL set id of the first drug label with the same content
+    duplicate_of = {}
+    seen = {}
+    for spl_set_id, label in drug_labels_to_extract.items():
+        key = hashlib.sha256(label['html_content'].encode()).digest()
+        if key not in seen:
+            seen[key] = spl_set_id
+            html_contents[spl_set_id] = label['html_content']
+        duplicate_of[spl_set_id] = seen[key]
+    print(f"Found {len(drug_labels_to_extract) - len(html_contents)} duplicate drug labels.")
+
+    if use_batch_api:
+        # only submit the drug labels that are not already cached
+        ae_dicts = {}
+        uncached_html_contents = {}
+        for spl_set_id, html_content in html_contents.items():
+            cached = _cache_lookup(html_content)
+            if cached is not None:
+                ae_dicts[spl_set_id] = _parse_response(cached)
+            else:
+                uncached_html_contents[spl_set_id] = html_content
+        print(f"Found {len(ae_dicts)} cached drug labels.")
+        if uncached_html_contents:
+            write_batch_requests(uncached_html_contents, batch_requests_file)
+            batch_id = submit_batch(batch_requests_file)
+            print(f"Submitted batch {batch_id} with {len(uncached_html_contents)} drug labels.")
+            batch = wait_for_batch(batch_id)
+            # read (and cache) any partial output before giving up on an expired or cancelled batch
+            ae_dicts.update(read_batch_results(batch, uncached_html_contents))
+            if batch.status != "completed":
+                raise RuntimeError(
+                    f"Batch {batch_id} ended with status {batch.status}; "
+                    f"its completed responses are cached and will not be resubmitted on the next run"
+                )
+    else:
+        ae_dicts = asyncio.run(parse_adverse_reactions_tables_llm(html_contents, concurrency, drugs_per_request))
+
+    for drug_spl_set_id, label in drug_labels_to_extract.items():
+        if duplicate_of[drug_spl_set_id] not in ae_dicts:
+            continue
+        ae_dict = dict(ae_dicts[duplicate_of[drug_spl_set_id]])
+        ae_dict['drug_spl_set_id'] = drug_spl_set_id
+        ae_dict['drug_route'] = label['drug_route']
+        # print(ae_dict)
+
+        # add this to all the information
+        print('added information')
+        drug_info.append(ae_dict)
+
+    # drump the drug_info into a JSON file
+    print(f"Writing {len(drug_info)} drug labels to file.")
+    with open('data/drug_info.json', 'wb') as f:
+        f.write(orjson.dumps(drug_info, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    build_adverse_effects_table(drug_info).to_parquet('data/adverse_effects.parquet', engine='pyarrow', compression='zstd', index=False)
+    print("Done.")
@@ -1,7 +1,24 @@
 import requests
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import os
 
 BASE_URL = "https://api.fda.gov/drug/label.json"
+# keep the query URLs of combined searches under this many characters
+MAX_URL_LENGTH = 2000
+# seconds to wait for the FDA API before giving up on a request
+TIMEOUT = 30.0
+# results per page, and the largest skip the FDA API accepts when paging through a query
+PAGE_LIMIT = 1000
+MAX_SKIP = 25000
+
+# a single session for the program's lifetime keeps the HTTPS connection to api.fda.gov alive
+# between calls, caches responses for a day, and retries rate limits and unavailability with
+# exponential backoff
+session = requests_cache.CachedSession('data/fda_cache', expire_after=86400, allowable_methods=('GET',))
+retries = Retry(total=5, backoff_factor=1, status_forcelist=[429, 503], allowed_methods=['GET'], raise_on_status=False)
+session.mount('https://', HTTPAdapter(max_retries=retries))
 
 def search_fda_label(ae_name: str) -> dict:
     """
@@ -16,7 +33,7 @@ def search_fda_label(ae_name: str) -> dict:
         'search': f'adverse_reactions_table:"{ae_name}"',
         'limit': 1000
     }
-    response = requests.get(BASE_URL, params=params)
+    response = session.get(BASE_URL, params=params, timeout=TIMEOUT)
     
     if response.status_code == 200:
         return response.json()
@@ -24,6 +41,73 @@ def search_fda_label(ae_name: str) -> dict:
         print(f"Error: {response.status_code}")
         return {}
     
+def _search_url(query: str) -> str:
+    """
+    Build the full URL of a search query, at its longest page.
+    """
+    request = requests.models.PreparedRequest()
+    request.prepare_url(BASE_URL, {'search': query, 'limit': PAGE_LIMIT, 'skip': MAX_SKIP})
+    return request.url
+
+def search_fda_labels(ae_names: list) -> dict:
+    """
+    Search for FDA labels mentioning any of several adverse effects, combining the names
+    into as few queries as possible with OR and paging through each query with skip.
+
+    The FDA API does not page past a skip of MAX_SKIP, so a query matching more labels than
+    that only returns the first MAX_SKIP + PAGE_LIMIT of them, and a warning is printed.
+
+    Args:
+        ae_names (list): The names of the adverse effects to search for.
+    Returns:
+        dict: {
+            'results': list of the FDA labels matching any of the adverse effects that could be
+            fetched, without duplicates
+        }
+    """
+    # group the names so that each query URL stays under MAX_URL_LENGTH
+    queries = []
+    clauses = []
+    for ae_name in ae_names:
+        clause = f'adverse_reactions_table:"{ae_name}"'
+        if clauses and len(_search_url(" OR ".join(clauses + [clause]))) > MAX_URL_LENGTH:
+            queries.append(" OR ".join(clauses))
+            clauses = []
+        clauses.append(clause)
+    if clauses:
+        queries.append(" OR ".join(clauses))
+
+    results = {}
+    for query in queries:
+        skip = 0
+        fetched = 0
+        total = 0
+        while skip <= MAX_SKIP:
+            params = {
+                'search': query,
+                'limit': PAGE_LIMIT,
+                'skip': skip
+            }
+            response = session.get(BASE_URL, params=params, timeout=TIMEOUT)
+
+            # the FDA API answers 404 when nothing matches the query
+            if response.status_code == 404:
+                break
+            if response.status_code != 200:
+                print(f"Error: {response.status_code}")
+                break
+            data = response.json()
+            total = data['meta']['results']['total']
+            for label in data['results']:
+                results[label['id']] = label
+            fetched += len(data['results'])
+            skip += PAGE_LIMIT
+            if fetched >= total or not data['results']:
+                break
+        if fetched < total:
+            print(f"Warning: fetched {fetched} of {total} labels for query {query}")
+    return {'results': list(results.values())}
+
 # test usage
 res = search_fda_label("nausea")
 print(res)
\ No newline at end of file